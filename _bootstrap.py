@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Thread Pool Bootstrap
+
+Import this before numpy, torch or whisper. It pins the OpenMP/BLAS thread
+pools to the physical core count; the default of one thread per logical
+core oversubscribes the GEMM kernels on hyperthreaded and hybrid CPUs.
+It also lets ops without an MPS kernel fall back to the CPU on Apple Silicon
+and keeps torch.compile's graphs in a persistent cache between runs.
+"""
+
+import os
+
+def _physical_cores():
+    """Physical core count, or the logical count where psutil isn't installed"""
+    try:
+        import psutil
+    except ImportError:
+        # e.g. the downgraded working environment
+        return os.cpu_count() or 4
+    return psutil.cpu_count(logical=False) or os.cpu_count() or 4
+
+def _thread_count():
+    """An explicit OMP_NUM_THREADS (e.g. from the working venv) wins if it's a positive integer"""
+    value = os.environ.get("OMP_NUM_THREADS", "").strip()
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    if value:
+        print(f"⚠️  Ignoring invalid OMP_NUM_THREADS={value!r}")
+    # Reset below, so the thread pools don't see the bad value either
+    os.environ.pop("OMP_NUM_THREADS", None)
+    return _physical_cores()
+
+NUM_THREADS = _thread_count()
+
+for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+            "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"):
+    os.environ.setdefault(var, str(NUM_THREADS))
+
+# whisper's STFT and word-timestamp ops aren't all implemented for MPS
+os.environ.setdefault("PYTORCH_ENABLE_MPS_FALLBACK", "1")
+
+# Reuse compiled decoder graphs across runs instead of recompiling each time
+os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.expanduser("~/.cache/whisper_inductor"))
@@ -5,69 +5,169 @@ Debug Resource Usage During OpenAI Whisper Hang
 This script monitors CPU, memory, and I/O during transcription to identify what's blocking
 """
 
+import _bootstrap  # Must come before numpy/torch set up their thread pools
 import os
 import sys
 import time
 import signal
+import importlib
+import contextlib
 import psutil
 import threading
-from datetime import datetime
+import numpy as np
 
-# Fix OpenMP library conflicts on macOS
-os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+SAMPLE_TEMPLATE = ("[{}] CPU: {:5.1f}% | Memory: {:7.1f}MB | Sys CPU: {:5.1f}% | "
+                   "Sys Mem: {:3.0f}% | IO Read: {:6.1f}MB | IO Write: {:6.1f}MB\n")
+
+# One row per sample; 3600 rows is an hour at one sample per second
+SAMPLE_DTYPE = [('t', 'f8'), ('cpu', 'f4'), ('rss', 'f4'), ('sys_cpu', 'f4'),
+                ('sys_mem', 'f4'), ('rd', 'u8'), ('wr', 'u8')]
+RESOURCE_LOG = "resource_log.csv"
 
 class ResourceMonitor:
-    """Monitor system resources during transcription"""
+    """Monitor system resources during transcription
+    
+    Samples go into a preallocated ring buffer and are written out as CSV
+    with a summary when monitoring stops, so the sampler does no terminal
+    I/O while transcription runs unless verbose is set. Events logged with
+    log_event (e.g. whisper progress) are shown against the nearest sample.
+    """
     
-    def __init__(self):
-        self.process = psutil.Process()
-        self.monitoring = False
+    def __init__(self, verbose=False, capacity=3600, pid=None):
+        self.process = psutil.Process(pid)
+        self.stop_event = threading.Event()
         self.monitor_thread = None
+        self.verbose = verbose
+        self.buf = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.i = 0
+        self.events = []
+        self.start_time = time.perf_counter()
         
     def start_monitoring(self):
         """Start resource monitoring in background thread"""
-        self.monitoring = True
+        self.stop_event.clear()
+        self.start_time = time.perf_counter()
         self.monitor_thread = threading.Thread(target=self._monitor_loop)
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
         print("🔍 Resource monitoring started in background...")
         
     def stop_monitoring(self):
-        """Stop resource monitoring"""
-        self.monitoring = False
+        """Stop resource monitoring, save the samples and print a summary"""
+        self.stop_event.set()
         if self.monitor_thread:
-            self.monitor_thread.join(timeout=1)
+            # Wait out an in-progress sample so the buffer isn't read mid-write
+            self.monitor_thread.join()
         print("🔍 Resource monitoring stopped")
         
+        samples = self.samples()
+        if len(samples) == 0:
+            return
+        
+        np.savetxt(RESOURCE_LOG, samples, delimiter=",",
+                   fmt=["%.3f", "%.1f", "%.1f", "%.1f", "%.0f", "%d", "%d"],
+                   header=",".join(name for name, _ in SAMPLE_DTYPE), comments="")
+        
+        print(f"\n📊 Resource summary ({len(samples)} samples, saved to {RESOURCE_LOG}):")
+        print(f"   {'':<12} {'min':>9} {'max':>9} {'mean':>9}")
+        for label, column in [("CPU %", 'cpu'), ("Memory MB", 'rss'),
+                              ("Sys CPU %", 'sys_cpu'), ("Sys Mem %", 'sys_mem')]:
+            values = samples[column]
+            print(f"   {label:<12} {values.min():9.1f} {values.max():9.1f} {values.mean():9.1f}")
+        print(f"   IO Read:  {(samples['rd'][-1] - samples['rd'][0])/1024/1024:.1f}MB, "
+              f"IO Write: {(samples['wr'][-1] - samples['wr'][0])/1024/1024:.1f}MB")
+        
+        if self.events:
+            print(f"\n🧭 Whisper progress timeline ({len(self.events)} events):")
+            for t, msg in self.events:
+                nearest = samples[min(np.searchsorted(samples['t'], t), len(samples) - 1)]
+                print(f"   {t:7.1f}s {msg:<28} | CPU: {nearest['cpu']:5.1f}% | Memory: {nearest['rss']:7.1f}MB")
+        
+    def log_event(self, msg):
+        """Mark msg on the monitor timeline at the current time"""
+        t = time.perf_counter() - self.start_time
+        self.events.append((t, msg))
+        if self.verbose:
+            sys.stderr.write(f"[{t:7.1f}s] ▶ {msg}\n")
+        
+    def samples(self):
+        """Recorded samples in time order (the oldest are overwritten once the buffer is full)"""
+        count = self.i
+        capacity = len(self.buf)
+        if count <= capacity:
+            return self.buf[:count].copy()
+        return np.roll(self.buf, -(count % capacity))
+        
     def _monitor_loop(self):
         """Monitor loop that runs in background"""
-        while self.monitoring:
+        # Prime the CPU counters so later calls return deltas without blocking
+        self.process.cpu_percent()
+        psutil.cpu_percent(interval=None)
+        
+        # Update every second; wait() returns True as soon as monitoring stops
+        while not self.stop_event.wait(1):
+            
             try:
-                # Get current process info
-                cpu_percent = self.process.cpu_percent()
-                memory_info = self.process.memory_info()
+                # Get current process info from one cached snapshot
+                with self.process.oneshot():
+                    cpu_percent = self.process.cpu_percent()
+                    memory_info = self.process.memory_info()
+                    io_counters = self.process.io_counters()
                 memory_mb = memory_info.rss / 1024 / 1024
                 
                 # Get system-wide info
-                system_cpu = psutil.cpu_percent(interval=0.1)
+                system_cpu = psutil.cpu_percent(interval=None)
                 system_memory = psutil.virtual_memory()
                 
-                # Get I/O info
-                io_counters = self.process.io_counters()
+                self.buf[self.i % len(self.buf)] = (
+                    time.perf_counter() - self.start_time, cpu_percent, memory_mb, system_cpu,
+                    system_memory.percent, io_counters.read_bytes, io_counters.write_bytes)
+                self.i += 1
                 
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                print(f"[{timestamp}] CPU: {cpu_percent:5.1f}% | "
-                      f"Memory: {memory_mb:7.1f}MB | "
-                      f"Sys CPU: {system_cpu:5.1f}% | "
-                      f"Sys Mem: {system_memory.percent:3.0f}% | "
-                      f"IO Read: {io_counters.read_bytes/1024/1024:6.1f}MB | "
-                      f"IO Write: {io_counters.write_bytes/1024/1024:6.1f}MB")
-                
-                time.sleep(1)  # Update every second
+                if self.verbose:
+                    timestamp = time.strftime("%H:%M:%S", time.localtime())
+                    # stderr keeps samples separate from the test's stdout output
+                    sys.stderr.write(SAMPLE_TEMPLATE.format(
+                        timestamp, cpu_percent, memory_mb, system_cpu, system_memory.percent,
+                        io_counters.read_bytes/1024/1024, io_counters.write_bytes/1024/1024))
                 
             except Exception as e:
-                print(f"⚠️  Monitoring error: {e}")
-                time.sleep(1)
+                sys.stderr.write(f"⚠️  Monitoring error: {e}\n")
+
+@contextlib.contextmanager
+def whisper_progress_events(monitor, backend):
+    """Log a monitor event every time whisper advances its progress bar
+    
+    openai-whisper updates its tqdm bar once per 30 s window, after decoding
+    and word-timestamp alignment; faster-whisper once per segment. The bar is
+    disabled by default but update() is still called, so a hang shows up as
+    the last window reached, next to the CPU/memory samples around it.
+    """
+    # import_module, because whisper.transcribe is shadowed by the function
+    if backend == "openai-whisper":
+        target = importlib.import_module("whisper.transcribe").tqdm  # used as tqdm.tqdm(...)
+        unit = "frames"
+    else:
+        target = importlib.import_module("faster_whisper.transcribe")  # has "from tqdm import tqdm"
+        unit = "s"
+    original = getattr(target, 'tqdm', None)
+    if original is None:
+        # faster-whisper before 1.0 has no progress bar to hook
+        yield
+        return
+    
+    class ProgressEvents(original):
+        def update(self, n=1):
+            # A disabled bar doesn't advance self.n, so count separately
+            self.done = getattr(self, 'done', 0) + n
+            monitor.log_event(f"progress={self.done:.0f}/{self.total:.0f} {unit}")
+            return super().update(n)
+    
+    target.tqdm = ProgressEvents
+    try:
+        yield
+    finally:
+        target.tqdm = original
 
 def test_with_resource_monitoring():
     """Test OpenAI Whisper with resource monitoring"""
@@ -77,17 +177,18 @@ def test_with_resource_monitoring():
     print()
     
     try:
-        # Import whisper
-        print("1. Importing OpenAI Whisper...")
-        import whisper
-        print("✅ OpenAI Whisper imported successfully")
+        # Import transcription backend
+        print("1. Importing Whisper backend...")
+        import transcribe_utils
+        import whisper_daemon
+        print(f"✅ {transcribe_utils.BACKEND} {transcribe_utils.BACKEND_VERSION} available")
         
         # Load model
         print("\n2. Loading model...")
-        start_time = time.time()
-        model = whisper.load_model("tiny")  # Use tiny for faster testing
-        load_time = time.time() - start_time
-        print(f"✅ Model loaded in {load_time:.2f}s")
+        start_time = time.perf_counter()
+        model = whisper_daemon.get_transcriber("tiny", use_daemon="--daemon" in sys.argv)  # Use tiny for faster testing
+        load_time = time.perf_counter() - start_time
+        print(f"✅ Model loaded in {load_time:.2f}s on {model.device}")
         
         # Load audio file
         print("\n3. Loading audio file...")
@@ -101,7 +202,11 @@ def test_with_resource_monitoring():
         
         # Start resource monitoring
         print("\n4. Starting resource monitoring...")
-        monitor = ResourceMonitor()
+        # Watch whichever process actually runs whisper (the daemon, if used)
+        monitor = ResourceMonitor(verbose="--verbose" in sys.argv, pid=model.pid)
+        if model.pid != os.getpid():
+            print(f"   Monitoring whisper daemon (pid {model.pid})")
+            print("   Progress events need the in-process model (run without --daemon)")
         monitor.start_monitoring()
         
         # Wait a moment for monitoring to start
@@ -109,23 +214,30 @@ def test_with_resource_monitoring():
         
         # Test transcription with monitoring
         print("\n5. Testing transcription with word timestamps...")
-        print("   Watch the resource usage above - if it hangs, we'll see what's happening")
+        if monitor.verbose:
+            print("   Watch the resource usage above - if it hangs, we'll see what's happening")
+        else:
+            print(f"   Resource samples are summarized and saved to {RESOURCE_LOG} at the end")
+            print("   (run with --verbose to watch them live)")
         print("   Press Ctrl+C to stop if it hangs")
         print()
         
         try:
-            transcribe_start = time.time()
+            transcribe_start = time.perf_counter()
             
             # This is where it hangs
-            result = model.transcribe(
-                audio_file,
-                language="en",
-                word_timestamps=True,
-                beam_size=5,
-                temperature=0.0
-            )
+            with contextlib.ExitStack() as stack:
+                if model.pid == os.getpid():
+                    stack.enter_context(whisper_progress_events(monitor, model.backend))
+                result = model.transcribe(
+                    audio_file,
+                    language="en",
+                    word_timestamps=True,
+                    beam_size=5,
+                    temperature=0.0
+                )
             
-            transcribe_time = time.time() - transcribe_start
+            transcribe_time = time.perf_counter() - transcribe_start
             print(f"\n✅ Transcription completed in {transcribe_time:.2f}s")
             
             if 'segments' in result and result['segments']:
@@ -13,16 +13,36 @@ if [ -n "$VIRTUAL_ENV" ]; then
     deactivate
 fi
 
-# Create new environment with working versions
-echo "Creating new virtual environment..."
-python3 -m venv .venv_working
-source .venv_working/bin/activate
+# Physical (not logical) cores for OpenMP
+PHYSICAL_CORES=$(sysctl -n hw.physicalcpu 2>/dev/null || lscpu -p=Core,Socket 2>/dev/null | grep -v '^#' | sort -u | wc -l)
+if [ "$PHYSICAL_CORES" -lt 1 ] 2>/dev/null; then
+    PHYSICAL_CORES=$(nproc)
+fi
+
+# Create new environment with working versions and a single OpenMP runtime
+if command -v conda >/dev/null 2>&1; then
+    echo "Creating new conda environment (nomkl, single OpenMP runtime)..."
+    conda create -y -p .venv_working python=3.10 nomkl "numpy==1.22.0"
+    source "$(conda info --base)/etc/profile.d/conda.sh"
+    conda activate ./.venv_working
+    mkdir -p .venv_working/etc/conda/activate.d
+    echo "export OMP_NUM_THREADS=$PHYSICAL_CORES" > .venv_working/etc/conda/activate.d/omp_threads.sh
+    ACTIVATE_CMD="conda activate ./.venv_working"
+else
+    echo "Creating new virtual environment..."
+    python3 -m venv .venv_working
+    echo "export OMP_NUM_THREADS=$PHYSICAL_CORES" >> .venv_working/bin/activate
+    source .venv_working/bin/activate
+    pip install --upgrade pip
+    pip install "numpy==1.22.0"
+    echo "⚠️  conda not found: pip wheels can't guarantee a single OpenMP runtime"
+    echo "   If quick_test.py reports more than one, use conda (with nomkl) instead"
+    ACTIVATE_CMD="source .venv_working/bin/activate"
+fi
 
 echo "Installing working package versions..."
-pip install --upgrade pip
 
 # Install specific working versions
-pip install "numpy==1.22.0"
 pip install "torch==1.13.1"
 pip install "tensorflow==2.13.1"
 pip install "numba==0.55.2"
@@ -33,8 +53,9 @@ pip install openai-whisper
 
 echo
 echo "✅ Working environment created!"
-echo "   Activate with: source .venv_working/bin/activate"
-echo "   Test with: python standalone_openai_whisper_test_fixed.py"
+echo "   Activate with: $ACTIVATE_CMD"
+echo "   OMP_NUM_THREADS=$PHYSICAL_CORES is set on activation"
+echo "   Test with: python quick_test.py && python standalone_openai_whisper_test_fixed.py"
 echo
 echo "⚠️  Note: This environment uses older package versions"
 echo "   Only use for testing the hanging issue"
@@ -3,12 +3,53 @@
 Quick test to verify OpenAI Whisper installation
 """
 
+import _bootstrap  # Must come before numpy/torch set up their thread pools
 import os
-os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import sys
+
+OPENMP_LIBRARIES = ("libiomp5", "libomp", "libgomp", "vcomp")
+
+def loaded_openmp_runtimes():
+    """Paths of the OpenMP runtimes loaded in this process, or None if they can't be listed"""
+    try:
+        from threadpoolctl import threadpool_info
+        return sorted({info['filepath'] for info in threadpool_info() if info['user_api'] == "openmp"})
+    except ImportError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return sorted({m.path for m in psutil.Process().memory_maps()
+                   if os.path.basename(m.path).startswith(OPENMP_LIBRARIES)})
+
+def check_openmp_runtimes():
+    """Warn if numpy and torch brought in more than one OpenMP runtime
+
+    Intel's iomp5 (from MKL) next to the libomp/libgomp bundled in the torch
+    wheel is the conflict KMP_DUPLICATE_LIB_OK used to hide; it has to be
+    fixed in the environment.
+    """
+    runtimes = loaded_openmp_runtimes()
+    if runtimes is None:
+        print("⚠️  Can't list loaded libraries (install threadpoolctl or psutil), OpenMP check skipped")
+    elif len(runtimes) > 1:
+        print(f"⚠️  {len(runtimes)} OpenMP runtimes loaded:")
+        for path in runtimes:
+            print(f"   {path}")
+        print("   Fix with: conda install nomkl numpy")
+        print("   Or run: ./downgrade_to_working_versions.sh")
+    else:
+        print("✅ Single OpenMP runtime")
 
 try:
+    import numpy
+    import torch
     import whisper
+    torch.set_num_threads(_bootstrap.NUM_THREADS)
+    check_openmp_runtimes()
     print("✅ OpenAI Whisper imported successfully")
+    print(f"   Threads: {torch.get_num_threads()} (physical cores)")
     print(f"   Version: {whisper.__version__}")
     
     # Test model loading
@@ -16,6 +57,13 @@ try:
     model = whisper.load_model("tiny")
     print("✅ Model loaded successfully")
     
+    # Keep a model resident so the debug scripts skip the cold load
+    if "--daemon" in sys.argv:
+        print("\n🔧 Preloading model in whisper daemon...")
+        import whisper_daemon
+        client = whisper_daemon.DaemonClient("tiny")
+        print(f"✅ Daemon ready ({client.backend}) on {whisper_daemon.SOCKET_PATH}")
+    
     print("\n🎯 OpenAI Whisper is working! Ready for debugging.")
     
 except Exception as e:
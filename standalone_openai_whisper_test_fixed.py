@@ -4,53 +4,48 @@ Standalone OpenAI Whisper Test (Fixed for OpenMP conflicts)
 
 This script tests OpenAI Whisper in isolation to identify the hanging issue.
 Run this on another system to debug the transcription problem.
+
+The OpenMP conflict is fixed in the environment (a single OpenMP runtime via
+nomkl, see downgrade_to_working_versions.sh) rather than by setting
+KMP_DUPLICATE_LIB_OK, which hides the conflict and slows OpenMP down.
 """
 
+import _bootstrap  # Must come before numpy/torch set up their thread pools
 import os
 import sys
 import time
-import signal
 import tempfile
 import numpy as np
 import soundfile as sf
 
-# Fix OpenMP library conflicts on macOS
-os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
-
-class TimeoutError(Exception):
-    """Custom timeout exception"""
-    pass
-
-def timeout_handler(signum, frame):
-    """Handle timeout signal"""
-    raise TimeoutError("Operation timed out")
-
 def test_openai_whisper_standalone():
     """Test OpenAI Whisper in complete isolation"""
     
     print("=== Standalone OpenAI Whisper Test (Fixed) ===")
     print("This test isolates OpenAI Whisper to identify hanging issues.")
-    print("OpenMP conflict workaround enabled.")
+    print("Expects a single OpenMP runtime (check with quick_test.py).")
     print()
     
     # Test 1: Basic import and model loading
-    print("1. Testing OpenAI Whisper import...")
+    print("1. Testing Whisper backend import...")
     try:
-        import whisper
-        print("✅ OpenAI Whisper imported successfully")
-        print(f"   Version: {whisper.__version__ if hasattr(whisper, '__version__') else 'Unknown'}")
+        import transcribe_utils
+        import whisper_daemon
+        print(f"✅ {transcribe_utils.BACKEND} available")
+        print(f"   Version: {transcribe_utils.BACKEND_VERSION}")
     except ImportError as e:
-        print(f"❌ OpenAI Whisper import failed: {e}")
+        print(f"❌ Whisper backend import failed: {e}")
         return False
     
     # Test 2: Model loading
     print("\n2. Testing model loading...")
     try:
-        start_time = time.time()
-        model = whisper.load_model("tiny")  # Start with tiny model
-        load_time = time.time() - start_time
+        start_time = time.perf_counter()
+        model = whisper_daemon.get_transcriber("tiny", use_daemon="--daemon" in sys.argv)  # Start with tiny model
+        load_time = time.perf_counter() - start_time
         print(f"✅ Model loaded successfully in {load_time:.2f}s")
-        print(f"   Model type: {type(model)}")
+        print(f"   Model type: {type(model).__name__} ({model.backend})")
+        print(f"   Device: {model.device}")
     except Exception as e:
         print(f"❌ Model loading failed: {e}")
         return False
@@ -73,8 +68,9 @@ def test_openai_whisper_standalone():
         print(f"   Duration: {duration:.2f}s, Sample rate: {sample_rate}Hz")
         print(f"   Audio shape: {audio.shape}, Type: {audio.dtype}")
         
-        # Use the original file path for transcription
-        temp_path = audio_file
+        # Decode once to 16 kHz mono float32 so transcription skips ffmpeg
+        audio = transcribe_utils.prepare_audio(audio, sample_rate)
+        print(f"   Prepared for transcription: {len(audio)} samples @ {transcribe_utils.SAMPLE_RATE}Hz")
         
     except Exception as e:
         print(f"❌ Audio file loading failed: {e}")
@@ -83,46 +79,44 @@ def test_openai_whisper_standalone():
     # Test 4: Basic transcription (no word timestamps)
     print("\n4. Testing basic transcription (no word timestamps)...")
     try:
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(60)  # 1 minute timeout
-        
-        start_time = time.time()
-        result = model.transcribe(temp_path, language="en")
-        signal.alarm(0)  # Cancel timeout
+        start_time = time.perf_counter()
+        # Text only, so whole 30 s windows can be encoded in batches
+        result = transcribe_utils.run_with_timeout(
+            model.transcribe_batched, 60,  # 1 minute timeout
+            audio,
+            batch_size=8,
+            language="en",
+            without_timestamps=True  # Text only, skip timestamp tokens
+        )
         
-        transcribe_time = time.time() - start_time
+        transcribe_time = time.perf_counter() - start_time
         print(f"✅ Basic transcription completed in {transcribe_time:.2f}s")
         print(f"   Text: '{result['text']}'")
         print(f"   Language: {result.get('language', 'Unknown')}")
         
     except TimeoutError:
-        signal.alarm(0)
         print("❌ Basic transcription timed out after 1 minute")
         print("   This indicates a fundamental hanging issue")
         return False
     except Exception as e:
-        signal.alarm(0)
         print(f"❌ Basic transcription failed: {e}")
         return False
     
     # Test 5: Word-level transcription (the problematic one)
     print("\n5. Testing word-level transcription (this is where it hangs)...")
     try:
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(120)  # 2 minutes timeout
-        
-        start_time = time.time()
-        result = model.transcribe(
-            temp_path,
+        start_time = time.perf_counter()
+        result = transcribe_utils.run_with_timeout(
+            model.transcribe, 120,  # 2 minutes timeout
+            audio,
             language="en",
             word_timestamps=True,
             beam_size=5,
-            best_of=5,
+            patience=2.0,  # Don't prune longer hypotheses with timestamps on
             temperature=0.0
         )
-        signal.alarm(0)  # Cancel timeout
         
-        transcribe_time = time.time() - start_time
+        transcribe_time = time.perf_counter() - start_time
         print(f"✅ Word-level transcription completed in {transcribe_time:.2f}s")
         
         if 'segments' in result and result['segments']:
@@ -136,17 +130,15 @@ def test_openai_whisper_standalone():
             print("   ⚠️  No segments found in result")
             
     except TimeoutError:
-        signal.alarm(0)
         print("❌ Word-level transcription timed out after 2 minutes")
         print("   This confirms the hanging issue is with word-level timestamps")
         return False
     except Exception as e:
-        signal.alarm(0)
         print(f"❌ Word-level transcription failed: {e}")
         return False
     
     # Cleanup
-    print(f"\n✅ Test completed - no cleanup needed (using original file)")
+    print(f"\n✅ Test completed - no cleanup needed (audio decoded in memory)")
     
     print("\n=== Test Summary ===")
     print("✅ All tests passed - OpenAI Whisper is working correctly")
@@ -10,10 +10,10 @@ import os
 import sys
 import time
 import signal
+import subprocess
 from datetime import datetime
-
-# Fix OpenMP library conflicts on macOS
-os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import version, PackageNotFoundError
 
 class TimeoutError(Exception):
     """Custom timeout exception"""
@@ -23,6 +23,64 @@ def timeout_handler(signum, frame):
     """Handle timeout signal"""
     raise TimeoutError("Operation timed out")
 
+# (display name, module / distribution name)
+LIBRARIES = [
+    ('NumPy', 'numpy'),
+    ('PyTorch', 'torch'),
+    ('TensorFlow', 'tensorflow'),
+    ('Numba', 'numba'),
+    ('librosa', 'librosa')
+]
+
+UNAVAILABLE = ("Not installed", "Import failed")
+
+# Libraries too heavy to import-check unless --full is given
+SLOW_IMPORTS = {'TensorFlow'}
+
+# Seconds a probe may take to import its library
+PROBE_TIMEOUT = 30
+SLOW_PROBE_TIMEOUT = 60
+
+def _installed_version(dist):
+    """Version of an installed distribution, without importing it"""
+    try:
+        return version(dist)
+    except PackageNotFoundError:
+        return "Not installed"
+
+def _probe_import(module, timeout=PROBE_TIMEOUT):
+    """Import module in a throwaway interpreter and return its __version__"""
+    try:
+        result = subprocess.run(
+            [sys.executable, "-c", f"import {module}; print({module}.__version__)"],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return "Import failed"
+    # Some libraries print at import time, the version is the last line
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return "Import failed"
+    return lines[-1].strip()
+
+def probe_imported_versions(libraries):
+    """Really import each library, in parallel and outside this process
+
+    Catches libraries whose metadata is present but which fail to load,
+    without leaving torch or TensorFlow resident in this process. Wall time
+    is the slowest import rather than the sum of all of them.
+    """
+    if not libraries:
+        return {}
+    names = [name for name, _ in libraries]
+    modules = [module for _, module in libraries]
+    timeouts = [SLOW_PROBE_TIMEOUT if name in SLOW_IMPORTS else PROBE_TIMEOUT for name in names]
+    # Each probe is its own interpreter, so threads only wait on them
+    with ThreadPoolExecutor(max_workers=len(modules)) as executor:
+        return dict(zip(names, executor.map(_probe_import, modules, timeouts)))
+
 def check_package_versions():
     """Check current package versions and compare with working environment"""
     
@@ -30,38 +88,23 @@ def check_package_versions():
     print("Comparing current environment with working wav_to_karaoke environment")
     print()
     
-    # Current environment versions
-    current_versions = {}
+    # Current environment versions, read from package metadata so nothing
+    # has to be imported just for a version string
+    current_versions = {name: _installed_version(module) for name, module in LIBRARIES}
     
-    try:
-        import numpy
-        current_versions['NumPy'] = numpy.__version__
-    except ImportError:
-        current_versions['NumPy'] = "Not installed"
+    # TensorFlow's import alone takes seconds and ~1.5 GB, so it is only
+    # load-checked with --full
+    probes = []
+    if "--import-check" in sys.argv:
+        probes = [(name, module) for name, module in LIBRARIES if name not in SLOW_IMPORTS]
+    if "--full" in sys.argv:
+        probes += [(name, module) for name, module in LIBRARIES if name in SLOW_IMPORTS]
+    probes = [(name, module) for name, module in probes if current_versions[name] != "Not installed"]
     
-    try:
-        import torch
-        current_versions['PyTorch'] = torch.__version__
-    except ImportError:
-        current_versions['PyTorch'] = "Not installed"
-    
-    try:
-        import tensorflow as tf
-        current_versions['TensorFlow'] = tf.__version__
-    except ImportError:
-        current_versions['TensorFlow'] = "Not installed"
-    
-    try:
-        import numba
-        current_versions['Numba'] = numba.__version__
-    except ImportError:
-        current_versions['Numba'] = "Not installed"
-    
-    try:
-        import librosa
-        current_versions['librosa'] = librosa.__version__
-    except ImportError:
-        current_versions['librosa'] = "Not installed"
+    if probes:
+        print(f"Import-checking {', '.join(name for name, _ in probes)} in parallel subprocesses...")
+        print()
+        current_versions.update(probe_imported_versions(probes))
     
     # Working environment versions (from wav_to_karaoke)
     working_versions = {
@@ -83,7 +126,10 @@ def check_package_versions():
         working = working_versions[lib]
         
         # Check for potential issues
-        if lib == 'NumPy' and current != 'Not installed':
+        if current == "Import failed":
+            status = "❌ FAILED"
+            potential_issues.append(f"{lib} is installed but fails to import")
+        elif lib == 'NumPy' and current not in UNAVAILABLE:
             current_major = int(current.split('.')[0])
             working_major = int(working.split('.')[0])
             if current_major > working_major:
@@ -91,7 +137,7 @@ def check_package_versions():
                 potential_issues.append(f"NumPy {current} vs {working} - Major version difference")
             else:
                 status = "✅ OK"
-        elif lib == 'PyTorch' and current != 'Not installed':
+        elif lib == 'PyTorch' and current not in UNAVAILABLE:
             current_major = int(current.split('.')[0])
             working_major = int(working.split('.')[0])
             if current_major > working_major:
@@ -99,7 +145,7 @@ def check_package_versions():
                 potential_issues.append(f"PyTorch {current} vs {working} - Major version difference")
             else:
                 status = "✅ OK"
-        elif lib == 'Numba' and current != 'Not installed':
+        elif lib == 'Numba' and current not in UNAVAILABLE:
             current_major = int(current.split('.')[0])
             working_major = int(working.split('.')[0])
             if current_major > working_major:
@@ -145,16 +191,36 @@ if [ -n "$VIRTUAL_ENV" ]; then
     deactivate
 fi
 
-# Create new environment with working versions
-echo "Creating new virtual environment..."
-python3 -m venv .venv_working
-source .venv_working/bin/activate
+# Physical (not logical) cores for OpenMP
+PHYSICAL_CORES=$(sysctl -n hw.physicalcpu 2>/dev/null || lscpu -p=Core,Socket 2>/dev/null | grep -v '^#' | sort -u | wc -l)
+if [ "$PHYSICAL_CORES" -lt 1 ] 2>/dev/null; then
+    PHYSICAL_CORES=$(nproc)
+fi
+
+# Create new environment with working versions and a single OpenMP runtime
+if command -v conda >/dev/null 2>&1; then
+    echo "Creating new conda environment (nomkl, single OpenMP runtime)..."
+    conda create -y -p .venv_working python=3.10 nomkl "numpy==1.22.0"
+    source "$(conda info --base)/etc/profile.d/conda.sh"
+    conda activate ./.venv_working
+    mkdir -p .venv_working/etc/conda/activate.d
+    echo "export OMP_NUM_THREADS=$PHYSICAL_CORES" > .venv_working/etc/conda/activate.d/omp_threads.sh
+    ACTIVATE_CMD="conda activate ./.venv_working"
+else
+    echo "Creating new virtual environment..."
+    python3 -m venv .venv_working
+    echo "export OMP_NUM_THREADS=$PHYSICAL_CORES" >> .venv_working/bin/activate
+    source .venv_working/bin/activate
+    pip install --upgrade pip
+    pip install "numpy==1.22.0"
+    echo "⚠️  conda not found: pip wheels can't guarantee a single OpenMP runtime"
+    echo "   If quick_test.py reports more than one, use conda (with nomkl) instead"
+    ACTIVATE_CMD="source .venv_working/bin/activate"
+fi
 
 echo "Installing working package versions..."
-pip install --upgrade pip
 
 # Install specific working versions
-pip install "numpy==1.22.0"
 pip install "torch==1.13.1"
 pip install "tensorflow==2.13.1"
 pip install "numba==0.55.2"
@@ -165,8 +231,9 @@ pip install openai-whisper
 
 echo
 echo "✅ Working environment created!"
-echo "   Activate with: source .venv_working/bin/activate"
-echo "   Test with: python standalone_openai_whisper_test_fixed.py"
+echo "   Activate with: $ACTIVATE_CMD"
+echo "   OMP_NUM_THREADS=$PHYSICAL_CORES is set on activation"
+echo "   Test with: python quick_test.py && python standalone_openai_whisper_test_fixed.py"
 echo
 echo "⚠️  Note: This environment uses older package versions"
 echo "   Only use for testing the hanging issue"
@@ -208,6 +275,10 @@ def main():
     
     print("\n🔍 To test the version theory:")
     print("   Run the downgrade script and test if word-level transcription works")
+    if "--import-check" not in sys.argv:
+        print("   Add --import-check to verify each library actually imports")
+    if "--full" not in sys.argv:
+        print("   Add --full to also import-check TensorFlow (slow)")
 
 if __name__ == "__main__":
     try:
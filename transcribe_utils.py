@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Shared Whisper Transcription Helpers
+
+Loads Whisper models and runs transcription for the debug scripts. The
+faster-whisper (CTranslate2) INT8 backend is used when it is installed,
+with OpenAI Whisper as the fallback. Results always come back in the
+OpenAI Whisper dict shape so the scripts don't care which backend ran.
+"""
+
+import _bootstrap  # Must come before numpy/torch set up their thread pools
+import os
+import time
+import threading
+import importlib.util
+from importlib.metadata import version, PackageNotFoundError
+
+# Detect the backend without importing it, so clients of the whisper daemon
+# never pay for the torch/CTranslate2 import themselves
+if importlib.util.find_spec("faster_whisper") is not None:
+    BACKEND = "faster-whisper"
+elif importlib.util.find_spec("whisper") is not None:
+    BACKEND = "openai-whisper"
+else:
+    raise ImportError("Neither faster-whisper nor openai-whisper is installed")
+
+try:
+    BACKEND_VERSION = version(BACKEND)
+except PackageNotFoundError:
+    BACKEND_VERSION = "Unknown"
+
+# Whisper models expect 16 kHz mono input
+SAMPLE_RATE = 16000
+
+# Small model for the word-alignment pass; alignment barely improves with
+# model size, so the large model only needs to produce the text
+ALIGN_MODEL = "tiny.en"
+
+# Punctuation whisper attaches to the neighbouring word (transcribe() defaults)
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
+
+# Decoder steps timed eager vs compiled; about a typical segment's token count
+COMPILE_BENCH_STEPS = 96
+
+# OpenAI Whisper options that have no CTranslate2 equivalent
+CT2_UNSUPPORTED_OPTIONS = ("best_of", "fp16", "verbose")
+
+class TranscriptionCancelled(Exception):
+    """Raised inside a transcription once its cancel_event is set"""
+    pass
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise TranscriptionCancelled("Transcription cancelled after deadline")
+
+# Alignment models stay loaded for the life of the process
+_align_models = {}
+
+def select_device():
+    """Pick the fastest torch device for openai-whisper; it never chooses MPS itself"""
+    import torch
+
+    if torch.backends.mps.is_available():
+        return "mps"
+    if torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+def _load_openai_model(model_name, in_memory=False, half=False):
+    import torch
+    import whisper
+
+    torch.set_num_threads(_bootstrap.NUM_THREADS)
+    device = select_device()
+    model = whisper.load_model(model_name, device="cpu", in_memory=in_memory)
+
+    if device != "cpu":
+        try:
+            model = model.to(device)
+        except (RuntimeError, NotImplementedError) as e:
+            # alignment_heads is a sparse COO buffer, which torch builds
+            # without SparseMPS can't move to MPS
+            print(f"⚠️  Can't move {model_name} to {device} ({e}), using CPU")
+            model = model.to("cpu")
+            device = "cpu"
+
+    if half and device == "mps":
+        # whisper's LayerNorm runs in float32 and expects float32 weights
+        model.half()
+        for module in model.modules():
+            if isinstance(module, torch.nn.LayerNorm):
+                module.float()
+    return model
+
+class Transcriber:
+    """Whisper model wrapper that hides which backend is in use"""
+
+    def __init__(self, model_name, in_memory=False):
+        self.model_name = model_name
+        self.backend = BACKEND
+        self.pid = os.getpid()
+
+        if self.backend == "faster-whisper":
+            import faster_whisper
+            # CTranslate2 has no MPS backend, INT8 on the CPU is its fast path
+            self.device = "cpu"
+            self.model = faster_whisper.WhisperModel(
+                model_name,
+                device=self.device,
+                compute_type="int8",
+                cpu_threads=_bootstrap.NUM_THREADS,
+                num_workers=1
+            )
+        else:
+            self.model = _load_openai_model(model_name, in_memory=in_memory, half=True)
+            self.device = self.model.device.type
+
+        self.compiled = False
+        self.compile_speedup = None
+        self._pipeline = None
+
+    def compile_decoder(self, steps=COMPILE_BENCH_STEPS):
+        """torch.compile the text decoder, keeping it only if it beats eager
+
+        The decoder's input shapes change with every token (the kv-cache
+        length sets the positional embedding slice), so it is compiled with
+        dynamic shapes; a static compile recompiles per length until dynamo's
+        cache limit and then silently runs eager. Eager and compiled are
+        timed over the same steps-token cached decode and the faster one is
+        kept; compile_speedup records the ratio. Compiled graphs persist in
+        the inductor FX cache set up by _bootstrap, so only the first run on
+        a machine pays the full compile time. Returns False where torch.compile
+        is unsupported or not faster.
+        """
+        if self.compile_speedup is not None:
+            return self.compiled
+        if self.backend != "openai-whisper":
+            return False
+
+        import torch
+        import whisper
+
+        if not hasattr(torch, "compile"):
+            return False
+
+        fp16 = self.device != "cpu"
+        dtype = torch.float16 if fp16 else torch.float32
+        mel = torch.zeros(1, self.model.dims.n_mels, whisper.audio.N_FRAMES, device=self.model.device)
+        with torch.no_grad():
+            audio_features = self.model.encoder(mel.to(dtype))
+
+        self._time_decoder(audio_features, 4)
+        eager_time = self._time_decoder(audio_features, steps)
+
+        eager_decoder = self.model.decoder
+        self.model.decoder = torch.compile(eager_decoder, dynamic=True)
+        # Compile for the first-token and cached shapes, then through decode()
+        self._time_decoder(audio_features, 4)
+        whisper.decode(self.model, mel, whisper.DecodingOptions(fp16=fp16))
+        compiled_time = self._time_decoder(audio_features, steps)
+
+        self.compile_speedup = eager_time / compiled_time
+        self.compiled = compiled_time < eager_time
+        if not self.compiled:
+            self.model.decoder = eager_decoder
+        return self.compiled
+
+    def _time_decoder(self, audio_features, steps):
+        """Seconds for steps single-token decoder calls on a growing kv cache, like decode()'s loop"""
+        import torch
+
+        tokens = torch.zeros(1, 1, dtype=torch.long, device=self.model.device)
+        kv_cache, hooks = self.model.install_kv_cache_hooks()
+        try:
+            start_time = time.perf_counter()
+            with torch.no_grad():
+                for _ in range(steps):
+                    self.model.decoder(tokens, audio_features, kv_cache=kv_cache)
+            if self.device == "cuda":
+                torch.cuda.synchronize()
+            elif self.device == "mps":
+                torch.mps.synchronize()
+            return time.perf_counter() - start_time
+        finally:
+            for hook in hooks:
+                hook.remove()
+
+    def transcribe(self, audio, cancel_event=None, **kwargs):
+        """Transcribe a file path or 16 kHz float32 array, returning an OpenAI Whisper style dict
+
+        cancel_event is polled between 30 s windows (openai-whisper) or
+        segments (faster-whisper) and stops the decode once it is set.
+        """
+        if self.backend == "openai-whisper":
+            return self._transcribe_openai(audio, cancel_event, **kwargs)
+
+        for option in CT2_UNSUPPORTED_OPTIONS:
+            kwargs.pop(option, None)
+
+        segments, info = self.model.transcribe(audio, **kwargs)
+        return _collect_segments(segments, info, cancel_event)
+
+    def transcribe_batched(self, audio, batch_size=8, cancel_event=None, **kwargs):
+        """Text-only transcription that encodes batch_size 30 s windows per forward pass"""
+        if self.backend == "faster-whisper":
+            try:
+                from faster_whisper import BatchedInferencePipeline
+            except ImportError:
+                # Batched inference arrived in faster-whisper 1.1
+                return self.transcribe(audio, cancel_event=cancel_event, **kwargs)
+
+            if self._pipeline is None:
+                self._pipeline = BatchedInferencePipeline(model=self.model)
+            for option in CT2_UNSUPPORTED_OPTIONS:
+                kwargs.pop(option, None)
+            segments, info = self._pipeline.transcribe(audio, batch_size=batch_size, **kwargs)
+            return _collect_segments(segments, info, cancel_event)
+
+        import torch
+        import whisper
+        from whisper.audio import CHUNK_LENGTH, N_FRAMES, N_SAMPLES
+
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+
+        # Remaining kwargs are DecodingOptions fields
+        fp16 = kwargs.pop('fp16', self.device != "cpu")
+        kwargs.setdefault('without_timestamps', True)
+        options = whisper.DecodingOptions(fp16=fp16, **kwargs)
+        dtype = torch.float16 if fp16 else torch.float32
+
+        duration = len(audio) / SAMPLE_RATE
+        n_windows = max(1, -(-len(audio) // N_SAMPLES))
+        segments = []
+
+        for batch_start in range(0, n_windows, batch_size):
+            _check_cancelled(cancel_event)
+            batch_end = min(batch_start + batch_size, n_windows)
+            mel_batch = torch.stack([
+                whisper.log_mel_spectrogram(
+                    whisper.pad_or_trim(audio[i * N_SAMPLES:(i + 1) * N_SAMPLES]),
+                    self.model.dims.n_mels
+                )
+                for i in range(batch_start, batch_end)
+            ]).to(self.model.device, dtype)
+
+            # One encoder pass for the whole batch; decode() sees encoded
+            # features and skips its own per-window encoder call
+            with torch.no_grad():
+                audio_features = self.model.encoder(mel_batch)
+            results = whisper.decode(self.model, audio_features, options)
+
+            for i, decoded in enumerate(results, start=batch_start):
+                segments.append({
+                    'id': i,
+                    'seek': i * N_FRAMES,
+                    'start': float(i * CHUNK_LENGTH),
+                    'end': min(float((i + 1) * CHUNK_LENGTH), duration),
+                    'text': " " + decoded.text if decoded.text else "",
+                    'tokens': decoded.tokens,
+                    'temperature': decoded.temperature,
+                    'avg_logprob': decoded.avg_logprob,
+                    'compression_ratio': decoded.compression_ratio,
+                    'no_speech_prob': decoded.no_speech_prob,
+                    'words': []
+                })
+
+        return {
+            'text': "".join(seg['text'] for seg in segments),
+            'segments': segments,
+            'language': options.language or results[0].language
+        }
+
+    def transcribe_speech_chunks(self, audio, cancel_event=None, **kwargs):
+        """Transcribe the VAD speech chunks of a file path or 16 kHz float32 array"""
+        if isinstance(audio, str):
+            audio = load_audio(audio)
+        return transcribe_speech_chunks(self, audio, cancel_event=cancel_event, **kwargs)
+
+    def align(self, result, audio, model_name=ALIGN_MODEL, cancel_event=None):
+        """Add word timestamps to a text-only result with align_words"""
+        return align_words(result, audio, model_name, cancel_event)
+
+    def _transcribe_openai(self, audio, cancel_event, **kwargs):
+        if cancel_event is None:
+            return self.model.transcribe(audio, **kwargs)
+
+        import whisper
+
+        # transcribe() calls model.decode once per 30 s window, so an instance
+        # attribute gives us a cancellation point inside its loop
+        def decode(mel, options):
+            _check_cancelled(cancel_event)
+            return whisper.decode(self.model, mel, options)
+
+        self.model.decode = decode
+        try:
+            return self.model.transcribe(audio, **kwargs)
+        finally:
+            del self.model.decode
+
+def _collect_segments(segments, info, cancel_event=None):
+    """Drain faster-whisper's lazy segment generator into an OpenAI Whisper style dict"""
+    result_segments = []
+    for seg in segments:
+        _check_cancelled(cancel_event)
+        result_segments.append({
+            'id': seg.id,
+            'seek': seg.seek,
+            'start': seg.start,
+            'end': seg.end,
+            'text': seg.text,
+            'tokens': list(seg.tokens),
+            'temperature': seg.temperature,
+            'avg_logprob': seg.avg_logprob,
+            'compression_ratio': seg.compression_ratio,
+            'no_speech_prob': seg.no_speech_prob,
+            'words': [
+                {
+                    'word': w.word,
+                    'start': w.start,
+                    'end': w.end,
+                    'probability': w.probability
+                }
+                for w in seg.words or []
+            ]
+        })
+
+    return {
+        'text': "".join(seg['text'] for seg in result_segments),
+        'segments': result_segments,
+        'language': info.language
+    }
+
+def run_with_timeout(func, timeout, *args, **kwargs):
+    """Call func in a worker thread, raising TimeoutError if it misses the deadline
+
+    func is passed a cancel_event keyword that is set on timeout so a
+    cooperative transcribe stops decoding instead of running on.
+    """
+    cancel_event = threading.Event()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome['result'] = func(*args, cancel_event=cancel_event, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+
+    # Daemon thread so a decode stuck in C code can't keep the process alive
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    thread.join(timeout)
+
+    if thread.is_alive():
+        cancel_event.set()
+        raise TimeoutError(f"Operation timed out after {timeout}s")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+def extract_words(result):
+    """Flatten a transcription result into parallel word/start/end/confidence arrays"""
+    import numpy as np
+
+    n = sum(len(seg.get('words') or []) for seg in result['segments'])
+    lyrics = {
+        'word': np.empty(n, dtype='U64'),
+        'start': np.empty(n, dtype=np.float32),
+        'end': np.empty(n, dtype=np.float32),
+        'confidence': np.empty(n, dtype=np.float32)
+    }
+
+    i = 0
+    for segment in result['segments']:
+        for word in segment.get('words') or []:
+            lyrics['word'][i] = word['word']
+            lyrics['start'][i] = word['start']
+            lyrics['end'][i] = word['end']
+            lyrics['confidence'][i] = word.get('probability', 1.0)
+            i += 1
+    return lyrics
+
+def prepare_audio(audio, sample_rate):
+    """Convert decoded audio to the mono float32 16 kHz array both backends accept"""
+    import numpy as np
+
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    audio = audio.astype(np.float32)
+
+    if sample_rate != SAMPLE_RATE:
+        try:
+            import torch
+            import torchaudio
+        except ImportError:
+            # The downgraded working environment has scipy (via librosa) but no torchaudio
+            from math import gcd
+            from scipy.signal import resample_poly
+
+            divisor = gcd(int(sample_rate), SAMPLE_RATE)
+            return resample_poly(audio, SAMPLE_RATE // divisor, int(sample_rate) // divisor).astype(np.float32)
+
+        # Renamed from "kaiser_window" in torchaudio 2.0
+        major = int(torchaudio.__version__.split('.')[0])
+        method = "sinc_interp_kaiser" if major >= 2 else "kaiser_window"
+
+        # ATen's vectorized Kaiser-windowed sinc resampler
+        audio = torchaudio.functional.resample(
+            torch.from_numpy(audio),
+            sample_rate,
+            SAMPLE_RATE,
+            lowpass_filter_width=16,
+            resampling_method=method
+        ).numpy()
+    return audio
+
+def load_audio(path):
+    """Decode an audio file once so transcribe doesn't spawn ffmpeg for it"""
+    import soundfile as sf
+
+    audio, sample_rate = sf.read(path)
+    return prepare_audio(audio, sample_rate)
+
+def transcribe_speech_chunks(transcriber, audio, min_silence_duration_ms=500,
+                             max_speech_duration_s=30, **kwargs):
+    """Transcribe only the speech regions Silero VAD finds, with timestamps relative to the full audio"""
+    try:
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+    except ImportError:
+        # VAD ships with faster-whisper; without it decode the whole file
+        return transcriber.transcribe(audio, **kwargs)
+
+    vad_options = VadOptions(
+        min_silence_duration_ms=min_silence_duration_ms,
+        max_speech_duration_s=max_speech_duration_s
+    )
+    chunks = get_speech_timestamps(audio, vad_options=vad_options)
+
+    segments = []
+    language = kwargs.get('language')
+    for chunk in chunks:
+        offset = chunk['start'] / SAMPLE_RATE
+        result = transcriber.transcribe(audio[chunk['start']:chunk['end']], **kwargs)
+        language = language or result.get('language')
+
+        for segment in result['segments']:
+            segment['id'] = len(segments)
+            segment['start'] += offset
+            segment['end'] += offset
+            for word in segment.get('words') or []:
+                word['start'] += offset
+                word['end'] += offset
+            segments.append(segment)
+
+    return {
+        'text': "".join(seg['text'] for seg in segments),
+        'segments': segments,
+        'language': language
+    }
+
+def align_words(result, audio, model_name=ALIGN_MODEL, cancel_event=None):
+    """Add word timestamps to a text-only result by force-aligning each segment with a small model"""
+    import whisper
+    from whisper.audio import HOP_LENGTH, N_SAMPLES
+    from whisper.timing import find_alignment, merge_punctuations
+    from whisper.tokenizer import get_tokenizer
+
+    if model_name not in _align_models:
+        # fp32 on MPS when available. Alignment on MPS is untested, and
+        # word-timestamp alignment is the path the README reports hanging
+        _align_models[model_name] = _load_openai_model(model_name)
+    model = _align_models[model_name]
+
+    tokenizer = get_tokenizer(
+        model.is_multilingual,
+        num_languages=model.num_languages,
+        language=result.get('language') or "en",
+        task="transcribe"
+    )
+
+    for segment in result['segments']:
+        _check_cancelled(cancel_event)
+        start_sample = int(segment['start'] * SAMPLE_RATE)
+        segment_audio = audio[start_sample:int(segment['end'] * SAMPLE_RATE)]
+        # Re-encode the text, the large model's tokens may use another vocabulary
+        text_tokens = tokenizer.encode(segment['text'])
+        if not text_tokens or len(segment_audio) == 0:
+            segment['words'] = []
+            continue
+
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(segment_audio), model.dims.n_mels)
+        num_frames = min(len(segment_audio), N_SAMPLES) // HOP_LENGTH
+        alignment = find_alignment(model, tokenizer, text_tokens, mel.to(model.device), num_frames)
+        merge_punctuations(alignment, PREPEND_PUNCTUATIONS, APPEND_PUNCTUATIONS)
+
+        segment['words'] = [
+            {
+                'word': timing.word,
+                'start': round(segment['start'] + float(timing.start), 2),
+                'end': round(segment['start'] + float(timing.end), 2),
+                'probability': float(timing.probability)
+            }
+            for timing in alignment if timing.word
+        ]
+
+    return result
+
+def transcribe_with_alignment(transcriber, audio, align_model=ALIGN_MODEL, cancel_event=None, **kwargs):
+    """Two-pass transcription: text from transcriber, word timestamps from align_model"""
+    kwargs.pop('word_timestamps', None)
+
+    # The alignment pass needs openai-whisper's timing code
+    if importlib.util.find_spec("whisper") is None:
+        return transcriber.transcribe_speech_chunks(
+            audio, cancel_event=cancel_event, word_timestamps=True, **kwargs)
+
+    # Both passes run wherever the transcriber lives, so a daemon keeps the
+    # VAD session and the align model loaded too
+    result = transcriber.transcribe_speech_chunks(
+        audio, cancel_event=cancel_event, word_timestamps=False, **kwargs)
+    _check_cancelled(cancel_event)
+    return transcriber.align(result, audio, align_model, cancel_event=cancel_event)
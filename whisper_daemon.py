@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Persistent Whisper Model Daemon
+
+Keeps Whisper models resident in a long-lived process and services
+transcription requests over a UNIX socket, so repeated test runs skip the
+torch import and weight deserialization.
+
+Each message is a struct header (JSON length, payload length) followed by a
+JSON body and an optional raw float32 audio payload. Run this file directly
+to start the daemon in the foreground; DaemonClient spawns it on first use
+when a script is run with --daemon.
+
+Pings are answered while a request runs, with what the daemon is busy on.
+New clients queue behind a busy daemon. A daemon is only replaced when it
+doesn't answer a ping, when its current request has outlived the client
+that sent it (the decode ignored the cancel, e.g. a hang in word-timestamp
+DTW) or its deadline, or when it runs another interpreter or an older copy
+of this code.
+"""
+
+import _bootstrap  # Must come before numpy/torch set up their thread pools
+import os
+import sys
+import json
+import time
+import stat
+import signal
+import hashlib
+import tempfile
+import select
+import socket
+import queue
+import struct
+import threading
+import subprocess
+import numpy as np
+
+# Per-user, so other local users can't plant a socket or pid file for us
+RUNTIME_DIR = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+                           f"whisper-{os.getuid()}")
+SOCKET_PATH = os.path.join(RUNTIME_DIR, "whisper.sock")
+
+# Pings are answered off the worker thread, so even a busy daemon replies at once
+PING_TIMEOUT = 5
+
+# A request still running this long after its client hung up ignored the
+# cancel and is stuck
+CANCEL_GRACE = 15
+
+# No single request (model download and load included) should take this long
+REQUEST_DEADLINE = 1800
+
+# Files whose contents the daemon runs; a change to any of them means a
+# running daemon is serving stale code
+SOURCE_FILES = ("_bootstrap.py", "transcribe_utils.py", "whisper_daemon.py")
+
+def _code_version():
+    """Hash of the daemon's source files"""
+    digest = hashlib.sha1()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCE_FILES:
+        with open(os.path.join(base_dir, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+CODE_VERSION = _code_version()
+
+def _pid_path(socket_path):
+    return socket_path + ".pid"
+
+def _log_path(socket_path):
+    return socket_path + ".log"
+
+def _private_dir(socket_path):
+    """Create the socket's directory if needed and check only this user can write to it"""
+    path = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise RuntimeError(f"{path} must be a directory owned by and writable only by uid {os.getuid()}")
+    return path
+
+# JSON body length, binary payload length
+HEADER = struct.Struct("!II")
+
+def send_message(sock, message, payload=b""):
+    """Send one framed message"""
+    body = json.dumps(message, default=float).encode()
+    sock.sendall(HEADER.pack(len(body), len(payload)) + body + payload)
+
+def _recv_exact(sock, size):
+    """Read exactly size bytes from the socket"""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def recv_message(sock):
+    """Receive one framed message, returning (message, payload)"""
+    body_len, payload_len = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    message = json.loads(_recv_exact(sock, body_len))
+    payload = _recv_exact(sock, payload_len)
+    return message, payload
+
+class ClientDisconnect:
+    """cancel_event stand-in that reports set once the client hangs up"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def is_set(self):
+        readable, _, _ = select.select([self.conn], [], [], 0)
+        return bool(readable) and not self.conn.recv(1, socket.MSG_PEEK)
+
+def _handle_request(models, conn, message, payload):
+    """Run one model request and send its reply on conn"""
+    import transcribe_utils
+
+    op = message['op']
+    name = message['model']
+    if name not in models:
+        start_time = time.perf_counter()
+        models[name] = transcribe_utils.Transcriber(name, in_memory=True)
+        print(f"✅ Loaded {name} in {time.perf_counter() - start_time:.2f}s", flush=True)
+    transcriber = models[name]
+
+    if op == "load":
+        send_message(conn, {'ok': True, 'backend': transcriber.backend, 'device': transcriber.device,
+                            'pid': transcriber.pid})
+    elif op == "compile":
+        compiled = transcriber.compile_decoder()
+        send_message(conn, {'ok': True, 'compiled': compiled, 'speedup': transcriber.compile_speedup})
+    elif op == "align":
+        audio = np.frombuffer(payload, dtype=np.float32).copy()
+        result = transcriber.align(
+            message['result'], audio, message['align_model'],
+            cancel_event=ClientDisconnect(conn))
+        send_message(conn, {'ok': True, 'result': result})
+    elif op in ("transcribe", "transcribe_batched", "transcribe_speech_chunks"):
+        if payload:
+            audio = np.frombuffer(payload, dtype=np.float32).copy()
+        else:
+            audio = message['path']
+        # A client that gave up on its deadline closes the socket,
+        # which cancels the decode instead of finishing it unread
+        result = getattr(transcriber, op)(
+            audio, cancel_event=ClientDisconnect(conn), **message['kwargs'])
+        send_message(conn, {'ok': True, 'result': result})
+    else:
+        raise ValueError(f"Unknown op: {op}")
+
+def _worker(requests, models, status):
+    """Run queued model requests one at a time, recording the one in progress in status"""
+    while True:
+        conn, message, payload = requests.get()
+        with conn:
+            if ClientDisconnect(conn).is_set():
+                # Gave up while queued behind another request
+                continue
+            status.update(op=message['op'], since=time.perf_counter(), conn=conn, gone_since=None)
+            try:
+                _handle_request(models, conn, message, payload)
+            except ConnectionError as e:
+                print(f"⚠️  Client connection error: {e}", flush=True)
+            except Exception as e:
+                print(f"❌ Request failed: {e}", flush=True)
+                try:
+                    send_message(conn, {'ok': False, 'error': f"{type(e).__name__}: {e}"})
+                except OSError:
+                    pass
+            finally:
+                status.update(op=None, since=None, conn=None, gone_since=None)
+
+def _busy_status(status):
+    """What the worker is doing, for ping replies"""
+    op, since, conn = status['op'], status['since'], status['conn']
+    if op is None:
+        return {'busy_op': None, 'busy_for': 0.0, 'client_gone_for': 0.0}
+
+    now = time.perf_counter()
+    try:
+        gone = ClientDisconnect(conn).is_set()
+    except (OSError, ValueError):
+        # The worker closed conn between the snapshot and the check
+        gone = False
+    if gone and status['gone_since'] is None:
+        status['gone_since'] = now
+    gone_since = status['gone_since']
+    return {
+        'busy_op': op,
+        'busy_for': now - since,
+        'client_gone_for': now - gone_since if gone_since is not None else 0.0
+    }
+
+def serve(socket_path=SOCKET_PATH):
+    """Run the daemon loop, loading each requested model once
+
+    Model requests run one at a time on a worker thread; this thread keeps
+    accepting so ping and shutdown are answered even mid-transcription.
+    """
+    import transcribe_utils
+
+    models = {}
+    requests = queue.Queue()
+    status = {'op': None, 'since': None, 'conn': None, 'gone_since': None}
+    identity = {'executable': sys.executable, 'code_version': CODE_VERSION, 'pid': os.getpid()}
+
+    _private_dir(socket_path)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    with open(_pid_path(socket_path), "w") as f:
+        f.write(str(os.getpid()))
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    print(f"🔧 Whisper daemon ({transcribe_utils.BACKEND}) listening on {socket_path}", flush=True)
+
+    # Daemon thread: a decode stuck in C code mustn't keep shutdown from exiting
+    threading.Thread(target=_worker, args=(requests, models, status), daemon=True).start()
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                # A client that connects but never sends mustn't block pings
+                conn.settimeout(PING_TIMEOUT)
+                message, payload = recv_message(conn)
+                conn.settimeout(None)
+                op = message.get('op')
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Client connection error: {e}", flush=True)
+                conn.close()
+                continue
+
+            if op == "ping":
+                with conn:
+                    send_message(conn, dict(identity, **_busy_status(status), ok=True,
+                                            queued=requests.qsize()))
+            elif op == "shutdown":
+                with conn:
+                    send_message(conn, {'ok': True})
+                break
+            else:
+                requests.put((conn, message, payload))
+    finally:
+        server.close()
+        for path in (socket_path, _pid_path(socket_path)):
+            if os.path.exists(path):
+                os.unlink(path)
+
+def _request_once(socket_path, message, payload=b"", timeout=None, cancel_event=None):
+    """Send one request and wait for its reply
+
+    Raises TimeoutError if no reply arrives within timeout seconds, or
+    TranscriptionCancelled once cancel_event is set.
+    """
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(PING_TIMEOUT)
+        sock.connect(socket_path)
+        send_message(sock, message, payload)
+        while not select.select([sock], [], [], 0.5)[0]:
+            if cancel_event is not None and cancel_event.is_set():
+                import transcribe_utils
+                raise transcribe_utils.TranscriptionCancelled("Transcription cancelled after deadline")
+            if deadline is not None and time.perf_counter() > deadline:
+                raise TimeoutError(f"Whisper daemon did not reply to {message['op']} within {timeout}s")
+        sock.settimeout(None)
+        reply, _ = recv_message(sock)
+    if not reply['ok']:
+        raise RuntimeError(f"Whisper daemon error: {reply['error']}")
+    return reply
+
+def stop_daemon(socket_path=SOCKET_PATH):
+    """Shut the daemon down, killing it if it doesn't answer; returns False if none was running"""
+    # Only trust the pid file in a directory no one else can write to
+    _private_dir(socket_path)
+    try:
+        _request_once(socket_path, {'op': "shutdown"}, timeout=PING_TIMEOUT)
+        # Let it remove its socket and pid file before a replacement creates new ones
+        deadline = time.perf_counter() + PING_TIMEOUT
+        while os.path.exists(_pid_path(socket_path)) and time.perf_counter() < deadline:
+            time.sleep(0.1)
+        return True
+    except TimeoutError:
+        hung = True
+    except OSError:
+        # Nothing listening; don't signal a pid from a stale file
+        hung = False
+
+    stopped = False
+    if hung:
+        # Not even the accept thread answers: SIGTERM still works, the socket
+        # and pid file are left behind
+        try:
+            with open(_pid_path(socket_path)) as f:
+                os.kill(int(f.read()), signal.SIGTERM)
+            stopped = True
+        except (OSError, ValueError):
+            pass
+    for path in (socket_path, _pid_path(socket_path)):
+        if os.path.exists(path):
+            os.unlink(path)
+    return stopped
+
+class DaemonClient:
+    """Transcriber stand-in that forwards requests to the whisper daemon"""
+
+    def __init__(self, model_name, socket_path=SOCKET_PATH, start_timeout=60, load_timeout=REQUEST_DEADLINE):
+        self.model_name = model_name
+        self.socket_path = socket_path
+        _private_dir(socket_path)
+
+        if not self._is_current():
+            stop_daemon(self.socket_path)
+            self._spawn(start_timeout)
+
+        # Generous, the load may queue behind another client's request and
+        # the first load of a model includes its download
+        reply = self._request({'op': "load"}, timeout=load_timeout)
+        self.backend = reply['backend']
+        self.device = reply['device']
+        self.pid = reply['pid']
+        self.compile_speedup = None
+
+    def _ping(self):
+        """The daemon's identity, or None if it isn't listening or doesn't answer"""
+        try:
+            return _request_once(self.socket_path, {'op': "ping"}, timeout=PING_TIMEOUT)
+        except (OSError, TimeoutError):
+            return None
+
+    def _is_current(self):
+        """True if a usable daemon runs this interpreter and this code
+
+        A daemon busy with another client's request is usable, requests queue
+        behind it. One running other code is only replaced once it is idle,
+        so another client's run isn't killed partway through.
+        """
+        waiting = False
+        while True:
+            reply = self._ping()
+            if reply is None:
+                if os.path.exists(self.socket_path):
+                    print("⚠️  Whisper daemon not responding, restarting it")
+                return False
+
+            op = reply['busy_op']
+            if op is not None and reply['client_gone_for'] > CANCEL_GRACE:
+                print(f"⚠️  Whisper daemon stuck in {op} {reply['client_gone_for']:.0f}s after its "
+                      "client gave up, restarting it")
+                return False
+            if op is not None and reply['busy_for'] > REQUEST_DEADLINE:
+                print(f"⚠️  Whisper daemon stuck in {op} for {reply['busy_for']:.0f}s, restarting it")
+                return False
+
+            current = reply['executable'] == sys.executable and reply['code_version'] == CODE_VERSION
+            if current:
+                if op is not None:
+                    print(f"⏳ Whisper daemon busy with {op} for another client, queueing behind it")
+                return True
+            if op is None:
+                print(f"⚠️  Whisper daemon runs {reply['executable']} (code {reply['code_version']}), "
+                      f"restarting it for {sys.executable} (code {CODE_VERSION})")
+                return False
+
+            if not waiting:
+                print(f"⏳ Whisper daemon runs other code and is busy with {op}, "
+                      "waiting for it to finish before replacing it")
+                waiting = True
+            time.sleep(1)
+
+    def _spawn(self, start_timeout):
+        """Start the daemon in its own session and wait for the socket"""
+        log = open(_log_path(self.socket_path), "a")
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--socket", self.socket_path],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            start_new_session=True
+        )
+        log.close()
+
+        deadline = time.perf_counter() + start_timeout
+        while time.perf_counter() < deadline:
+            if self._ping() is not None:
+                return
+            time.sleep(0.2)
+        raise RuntimeError(f"Whisper daemon did not start within {start_timeout}s (see {_log_path(self.socket_path)})")
+
+    def _request(self, message, payload=b"", timeout=None, cancel_event=None):
+        message = dict(message, model=self.model_name)
+        return _request_once(self.socket_path, message, payload, timeout, cancel_event)
+
+    def compile_decoder(self):
+        """Compile the daemon's decoder once; later clients reuse it"""
+        reply = self._request({'op': "compile"})
+        self.compile_speedup = reply['speedup']
+        return reply['compiled']
+
+    def _transcribe(self, op, audio, cancel_event, kwargs):
+        if isinstance(audio, str):
+            message = {'op': op, 'path': os.path.abspath(audio), 'kwargs': kwargs}
+            return self._request(message, cancel_event=cancel_event)['result']
+
+        payload = np.ascontiguousarray(audio, dtype=np.float32).tobytes()
+        message = {'op': op, 'path': None, 'kwargs': kwargs}
+        return self._request(message, payload, cancel_event=cancel_event)['result']
+
+    def transcribe(self, audio, cancel_event=None, **kwargs):
+        """Transcribe a file path or 16 kHz float32 array in the daemon"""
+        return self._transcribe("transcribe", audio, cancel_event, kwargs)
+
+    def transcribe_batched(self, audio, batch_size=8, cancel_event=None, **kwargs):
+        """Batched text-only transcription in the daemon"""
+        kwargs['batch_size'] = batch_size
+        return self._transcribe("transcribe_batched", audio, cancel_event, kwargs)
+
+    def transcribe_speech_chunks(self, audio, cancel_event=None, **kwargs):
+        """VAD-chunked transcription in the daemon, which keeps the VAD session loaded"""
+        return self._transcribe("transcribe_speech_chunks", audio, cancel_event, kwargs)
+
+    def align(self, result, audio, model_name=None, cancel_event=None):
+        """Word-align a text-only result with the daemon's resident align model"""
+        import transcribe_utils
+        payload = np.ascontiguousarray(audio, dtype=np.float32).tobytes()
+        message = {'op': "align", 'result': result,
+                   'align_model': model_name or transcribe_utils.ALIGN_MODEL}
+        return self._request(message, payload, cancel_event=cancel_event)['result']
+
+def get_transcriber(model_name, use_daemon=False):
+    """Return an in-process Transcriber, or a DaemonClient when use_daemon is True"""
+    if use_daemon:
+        return DaemonClient(model_name)
+
+    import transcribe_utils
+    return transcribe_utils.Transcriber(model_name)
+
+if __name__ == "__main__":
+    socket_path = SOCKET_PATH
+    if "--socket" in sys.argv:
+        socket_path = sys.argv[sys.argv.index("--socket") + 1]
+
+    if "--stop" in sys.argv:
+        if stop_daemon(socket_path):
+            print("🔧 Whisper daemon stopped")
+        else:
+            print("🔧 No whisper daemon running")
+        sys.exit(0)
+
+    try:
+        serve(socket_path)
+    except KeyboardInterrupt:
+        print("\n⚠️  Daemon interrupted by user")
+    # Don't wait on a worker thread that may be stuck in a decode
+    os._exit(0)